@@ -1,22 +1,32 @@
 import os
 import re
-import json
-import requests
+import functools
+import operator
+import weakref
+import orjson
+import aiohttp
 import sys
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 from loguru import logger
 from dotenv import load_dotenv
 import asyncio
+from collections import Counter
+from dataclasses import dataclass
 from datetime import datetime, timedelta
+from typing import Optional
+
+# Load environment variables
+load_dotenv()
+LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG")
 
 # Configure logging (only to stderr, no files)
 logger.remove()
-logger.add(sys.stderr, format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}", level="DEBUG")
+logger.add(sys.stderr, format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}", level=LOG_LEVEL)
 
-# Load environment variables
-load_dotenv()
+# Debug messages in per-post code are guarded by this flag so their f-strings aren't built when filtered out
+DEBUG = logger.level(LOG_LEVEL).no <= logger.level("DEBUG").no
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_ID = int(os.getenv("ADMIN_ID"))
 DEST_CHANNEL_ID = os.getenv("DEST_CHANNEL_ID")
@@ -24,11 +34,87 @@ DEST_CHANNEL_ID = os.getenv("DEST_CHANNEL_ID")
 # Data storage
 DATA_FILE = "channels.json"
 
+# HTTP client shared by all fetches, opened and closed with the application
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Connection': 'keep-alive'
+}
+http_session = None
+
+# Maximum number of channels fetched and processed at the same time
+POLL_CONCURRENCY = 5
+
+# Precompiled patterns for filter parsing, evaluation and post formatting
+_TIMER_COND_RE = re.compile(r'⏱️\{([><]=?)(\d+\.?\d*)\}\s*min')
+_STD_COND_RE = re.compile(r'(.+?)\{([><]=?)(\d+\.?\d*[%s]?)\}')
+_TIMER_POST_RE = re.compile(r'⏱️\s*(\d+\.?\d*)\s*min')
+_PLACEHOLDER_RE = re.compile(r'\{([^}]+)\}')
+
+# Only message blocks are built into the tree when parsing a channel page. While parsing, the
+# strainer sees the raw class string ("tgme_widget_message js-widget_message ..."), so match on data-post
+_STRAINER = SoupStrainer('div', attrs={'data-post': True})
+
+# Call template section header: {ЕСЛИ В ПОСТЕ <emoji>}
+_TEMPLATE_HEADER_PREFIX = '{ЕСЛИ В ПОСТЕ '
+_TEMPLATE_EMOJIS = ('🔴', '🟢', '🟥')
+
+# Comparison operators supported in numeric and timer conditions
+_OPS = {'>': operator.gt, '<': operator.lt, '>=': operator.ge, '<=': operator.le}
+
+# Extraction patterns for placeholders, combined into one alternation so a post is scanned once.
+# Each alternative captures its value in a named group mapped to the placeholder below.
+_EXTRACT_ALL_RE = re.compile(
+    r'Now last price:\s*\$?(?P<Now_last_price>\d+\.?\d*)'
+    r'|Price:\s*\$?(?P<Price>\d+\.?\d+)'
+    r'|ETA:\s*(?P<ETA>\d+m)'
+    # Add more alternatives here as needed for new placeholders
+)
+_EXTRACTION_GROUPS = {
+    'Now_last_price': 'Now last price',
+    'Price': 'Price',
+    'ETA': 'ETA'
+}
+_EXTRACTION_PLACEHOLDERS = frozenset(_EXTRACTION_GROUPS.values())
+
+@functools.lru_cache(maxsize=256)
+def _cond_pattern(key):
+    return re.compile(rf'{re.escape(key)}[\s:]*([-]?\d+\.?\d*)\s*(%|s)?')
+
+# In-memory copy of DATA_FILE, reloaded only when the file's mtime changes
+# 'invalid' holds entries that aren't channel objects; they are kept out of 'data' but written back on save
+_CACHE = {'data': None, 'mtime': 0, 'invalid': {}}
+
 # Load channels and filters
 def load_channels():
     try:
-        with open(DATA_FILE, 'r') as f:
-            channels = json.load(f)
+        mtime = os.stat(DATA_FILE).st_mtime_ns
+        if _CACHE['data'] is not None and _CACHE['mtime'] == mtime:
+            return _CACHE['data']
+        with open(DATA_FILE, 'rb') as f:
+            channels = orjson.loads(f.read())
+            # A malformed entry must not take the other channels down with it, and must not be
+            # rewritten either: it is left as stored and skipped until it is fixed
+            invalid = {}
+            for channel, data in list(channels.items()):
+                if not isinstance(data, dict):
+                    logger.error(f"Ignoring invalid entry for {channel} in {DATA_FILE}: {data!r}")
+                    invalid[channel] = channels.pop(channel)
+                    continue
+                try:
+                    channel_filter = normalize_filter(data.get('filter'))
+                    filter_fn = compile_filter(channel_filter['conditions'], channel_filter['all_must_match'])
+                except Exception as e:
+                    logger.error(f"Invalid filter for {channel} in {DATA_FILE}, skipping channel: {str(e)}")
+                    data['_filter_fn'] = None
+                    data['_filter_error'] = str(e)
+                    continue
+                data['filter'] = channel_filter
+                data['_filter_fn'] = filter_fn
+            _CACHE['data'] = channels
+            _CACHE['mtime'] = mtime
+            _CACHE['invalid'] = invalid
             logger.debug(f"Loaded channels from {DATA_FILE}: {channels}")
             return channels
     except FileNotFoundError:
@@ -40,79 +126,130 @@ def load_channels():
 
 def save_channels(channels):
     try:
-        with open(DATA_FILE, 'w') as f:
-            json.dump(channels, f, indent=2)
+        tmp_file = f"{DATA_FILE}.tmp"
+        # Keys starting with '_' hold runtime-only state (e.g. compiled filters) and are not persisted
+        persisted = {
+            channel: {key: value for key, value in data.items() if not key.startswith('_')}
+            for channel, data in channels.items()
+        }
+        for channel, data in _CACHE['invalid'].items():
+            persisted.setdefault(channel, data)
+        with open(tmp_file, 'wb') as f:
+            f.write(orjson.dumps(persisted, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+        os.replace(tmp_file, DATA_FILE)
+        _CACHE['data'] = channels
+        _CACHE['mtime'] = os.stat(DATA_FILE).st_mtime_ns
+        _CACHE['invalid'] = {
+            channel: data for channel, data in _CACHE['invalid'].items() if channel not in channels
+        }
         logger.debug(f"Saved channels to {DATA_FILE}: {channels}")
     except Exception as e:
         logger.error(f"Error saving channels to {DATA_FILE}: {str(e)}")
 
 # Filter parsing and evaluation
+
+# Identical conditions are shared across filters; plain dicts can't be weakly referenced, hence the subclass
+class _Condition(dict):
+    __slots__ = ('__weakref__',)
+
+_COND_CACHE = weakref.WeakValueDictionary()
+
+def _intern(cond):
+    key = tuple(sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in cond.items()))
+    got = _COND_CACHE.get(key)
+    if got is None:
+        got = _COND_CACHE[key] = _Condition(cond)
+    return got
+
+def normalize_filter(channel_filter):
+    # Older channels.json entries store a bare list of conditions, which were always
+    # evaluated with every condition required
+    if channel_filter is None:
+        return {'all_must_match': False, 'conditions': []}
+    if isinstance(channel_filter, list):
+        channel_filter = {'all_must_match': bool(channel_filter), 'conditions': channel_filter}
+    channel_filter['conditions'] = [_intern(cond) for cond in channel_filter['conditions']]
+    return channel_filter
+
 def parse_filter(filter_text):
-    logger.debug(f"Parsing filter: {filter_text}")
+    if DEBUG:
+        logger.debug(f"Parsing filter: {filter_text}")
     conditions = []
-    if '"' in filter_text:
-        quoted_conditions = re.findall(r'"([^"]+)"', filter_text)
-        logger.debug(f"Found quoted conditions: {quoted_conditions}")
+    all_must_match = '"' in filter_text
+    if all_must_match:
+        # Odd-indexed chunks sit between quote pairs; an unterminated trailing quote is ignored
+        quoted_conditions = [cond for cond in filter_text.split('"')[1:-1:2] if cond]
+        if DEBUG:
+            logger.debug(f"Found quoted conditions: {quoted_conditions}")
         for cond in quoted_conditions:
             parsed_cond = parse_single_condition(cond)
             conditions.append(parsed_cond)
-            logger.debug(f"Parsed quoted condition: {parsed_cond}")
+            if DEBUG:
+                logger.debug(f"Parsed quoted condition: {parsed_cond}")
     else:
         parts = filter_text.split('\n')
-        logger.debug(f"Filter split into parts: {parts}")
+        if DEBUG:
+            logger.debug(f"Filter split into parts: {parts}")
         for part in parts:
             part = part.strip()
             if part:
                 parsed_cond = parse_single_condition(part)
                 conditions.append(parsed_cond)
-                logger.debug(f"Parsed condition: {parsed_cond}")
-    logger.info(f"Filter parsed into conditions: {conditions}")
-    return conditions
+                if DEBUG:
+                    logger.debug(f"Parsed condition: {parsed_cond}")
+    logger.info(f"Filter parsed into conditions: {conditions} (all_must_match={all_must_match})")
+    return {'all_must_match': all_must_match, 'conditions': conditions}
 
 def parse_single_condition(condition):
-    logger.debug(f"Parsing single condition: {condition}")
+    if DEBUG:
+        logger.debug(f"Parsing single condition: {condition}")
     result = {}  # Initialize result
     if '/' in condition:
         result = {'type': 'alternatives', 'values': condition.split('/')}
-        logger.debug(f"Condition parsed as alternatives: {result}")
-        return result
-    match_timer = re.match(r'⏱️{([><]=?)(\d+\.?\d*)\}\s*min', condition)
+        if DEBUG:
+            logger.debug(f"Condition parsed as alternatives: {result}")
+        return _intern(result)
+    match_timer = _TIMER_COND_RE.match(condition)
     if match_timer:
-        operator, value = match_timer.groups()
+        op, value = match_timer.groups()
         result = {
             'type': 'timer',
-            'operator': operator,
+            'operator': op,
             'value': value
         }
-        logger.debug(f"Condition parsed as timer: {result}")
-        return result
+        if DEBUG:
+            logger.debug(f"Condition parsed as timer: {result}")
+        return _intern(result)
 
     # Handle standard condition with {operator value}
-    match = re.match(r'(.+?)\{([><]=?)(\d+\.?\d*[%s]?)\}', condition)
+    match = _STD_COND_RE.match(condition)
     if match:
-        key, operator, value = match.groups()
+        key, op, value = match.groups()
         result = {
             'type': 'condition',
             'key': key.strip(),
-            'operator': operator,
+            'operator': op,
             'value': value
         }
-        logger.debug(f"Condition parsed as standard condition: {result}")
-        return result
+        if DEBUG:
+            logger.debug(f"Condition parsed as standard condition: {result}")
+        return _intern(result)
 
     result = {'type': 'text', 'value': condition}
-    logger.debug(f"Condition parsed as text: {result}")
-    return result
+    if DEBUG:
+        logger.debug(f"Condition parsed as text: {result}")
+    return _intern(result)
 
 def evaluate_filter(post_text, conditions, all_must_match=False):
-    logger.debug(f"Evaluating filter for post text: {post_text[:100]}... (all_must_match={all_must_match})")
-    logger.debug(f"Conditions: {conditions}")
+    if DEBUG:
+        logger.debug(f"Evaluating filter for post text: {post_text[:100]}... (all_must_match={all_must_match})")
+        logger.debug(f"Conditions: {conditions}")
     if not conditions:
         logger.info("No conditions specified, returning True")
         return True
 
-    results = [check_condition(post_text, cond) for cond in conditions]
-    logger.debug(f"Condition results: {results}")
+    # Lazy so all()/any() stop at the first deciding condition
+    results = (check_condition(post_text, cond) for cond in conditions)
 
     if all_must_match:
         result = all(results)
@@ -122,75 +259,131 @@ def evaluate_filter(post_text, conditions, all_must_match=False):
     logger.info(f"At least one condition must match, result: {result}")
     return result
 
-def check_condition(post_text, condition):
-    logger.debug(f"Checking condition: {condition}")
-    if condition['type'] == 'text':
-        result = condition['value'] in post_text
+def _check_text(post_text, condition):
+    result = condition['value'] in post_text
+    if DEBUG:
         logger.debug(f"Text condition '{condition['value']}': {'found' if result else 'not found'} in post")
-        return result
-    elif condition['type'] == 'alternatives':
-        result = any(val in post_text for val in condition['values'])
+    return result
+
+def _check_alternatives(post_text, condition):
+    result = any(val in post_text for val in condition['values'])
+    if DEBUG:
         logger.debug(f"Alternatives condition {condition['values']}: {'match' if result else 'no match'}")
-        return result
-    elif condition['type'] == 'timer':
-        match = re.search(r'⏱️\s*(\d+\.?\d*)\s*min', post_text)
-        if not match:
-            logger.debug("Timer condition: no match found in post")
-            return False
-        post_value = float(match.group(1))
-        target_value = float(condition['value'])
+    return result
+
+def _check_timer(post_text, condition):
+    match = _TIMER_POST_RE.search(post_text)
+    if not match:
+        logger.debug("Timer condition: no match found in post")
+        return False
+    post_value = float(match.group(1))
+    target_value = float(condition['value'])
+    if DEBUG:
         logger.debug(
             f"Timer condition: post value={post_value} min, target value={target_value} min, operator={condition['operator']}")
-        if condition['operator'] == '>':
-            result = post_value > target_value
-        elif condition['operator'] == '<':
-            result = post_value < target_value
-        elif condition['operator'] == '>=':
-            result = post_value >= target_value
-        elif condition['operator'] == '<=':
-            result = post_value <= target_value
+    result = _OPS[condition['operator']](post_value, target_value)
+    if DEBUG:
         logger.debug(f"Timer condition result: {result}")
-        return result
-    elif condition['type'] == 'condition':
-        key = condition['key']
-        operator = condition['operator']
-        value = condition['value']
+    return result
 
-        match = re.search(rf'{re.escape(key)}[\s:]*([-]?\d+\.?\d*)\s*(%|s)?', post_text)
-        if not match:
+def _check_numeric(post_text, condition):
+    key = condition['key']
+    op = condition['operator']
+    value = condition['value']
+
+    match = _cond_pattern(key).search(post_text)
+    if not match:
+        if DEBUG:
             logger.debug(f"Condition '{key}': no match found in post, post text: {post_text[:200]}...")
-            return False
+        return False
 
-        post_value = float(match.group(1))
-        unit = match.group(2) if match.group(2) else ''
+    post_value = float(match.group(1))
+    unit = match.group(2) if match.group(2) else ''
+    if DEBUG:
         logger.debug(f"Condition '{key}': extracted post value={post_value}, unit={unit}")
 
-        expected_unit = value[-1] if value[-1] in '%s' else None
-        target_value = float(value.rstrip('%s'))
+    expected_unit = value[-1] if value[-1] in '%s' else None
+    target_value = float(value.rstrip('%s'))
+    if DEBUG:
         logger.debug(f"Condition '{key}': target value={target_value}, expected unit={expected_unit}")
 
-        if unit == '' and expected_unit is None:
+    if unit == '' and expected_unit is None:
+        if DEBUG:
             logger.debug(f"Condition '{key}': both units absent, proceeding with comparison")
-        elif unit != expected_unit:
+    elif unit != expected_unit:
+        if DEBUG:
             logger.debug(
                 f"Condition '{key}': unit mismatch (post unit={unit}, filter unit={expected_unit})")
-            return False
+        return False
 
-        post_value = abs(post_value)
+    post_value = abs(post_value)
+    if DEBUG:
         logger.debug(f"Condition '{key}': using absolute post value={post_value}")
 
-        if operator == '>':
-            result = post_value > target_value
-        elif operator == '<':
-            result = post_value < target_value
-        elif operator == '>=':
-            result = post_value >= target_value
-        elif operator == '<=':
-            result = post_value <= target_value
-        logger.debug(f"Condition '{key}': {post_value} {operator} {target_value} -> {result}")
-        return result
-    logger.debug(f"Unknown condition type: {condition['type']}")
-    return False
+    result = _OPS[op](post_value, target_value)
+    if DEBUG:
+        logger.debug(f"Condition '{key}': {post_value} {op} {target_value} -> {result}")
+    return result
+
+_CONDITION_CHECKS = {
+    'text': _check_text,
+    'alternatives': _check_alternatives,
+    'timer': _check_timer,
+    'condition': _check_numeric
+}
+
+def check_condition(post_text, condition):
+    if DEBUG:
+        logger.debug(f"Checking condition: {condition}")
+    check = _CONDITION_CHECKS.get(condition['type'])
+    if check is None:
+        if DEBUG:
+            logger.debug(f"Unknown condition type: {condition['type']}")
+        return False
+    return check(post_text, condition)
+
+# Build a specialized predicate for a filter so polling doesn't re-dispatch on condition types per post
+def compile_filter(conditions, all_must_match=False):
+    namespace = {}
+    terms = []
+    for i, cond in enumerate(conditions):
+        if cond['type'] == 'text':
+            terms.append(f"{cond['value']!r} in post_text")
+        elif cond['type'] == 'alternatives':
+            alternatives = ' or '.join(f"{val!r} in post_text" for val in cond['values'])
+            terms.append(f"({alternatives})" if alternatives else "False")
+        elif cond.get('operator') is not None and cond['operator'] not in _OPS:
+            logger.warning(f"Unknown operator in filter: {cond['operator']}")
+            terms.append("False")
+        elif cond['type'] == 'timer':
+            namespace[f'search{i}'] = _TIMER_POST_RE.search
+            namespace[f'op{i}'] = _OPS[cond['operator']]
+            terms.append(
+                f"((m := search{i}(post_text)) is not None"
+                f" and op{i}(float(m.group(1)), {float(cond['value'])!r}))")
+        elif cond['type'] == 'condition':
+            value = cond['value']
+            expected_unit = value[-1] if value[-1] in '%s' else None
+            namespace[f'search{i}'] = _cond_pattern(cond['key']).search
+            namespace[f'op{i}'] = _OPS[cond['operator']]
+            terms.append(
+                f"((m := search{i}(post_text)) is not None and m.group(2) == {expected_unit!r}"
+                f" and op{i}(abs(float(m.group(1))), {float(value.rstrip('%s'))!r}))")
+        else:
+            logger.warning(f"Unknown condition type in filter: {cond['type']}")
+            terms.append("False")
+
+    body = (' and ' if all_must_match else ' or ').join(terms) if terms else "True"
+    source = f"def _filter(post_text):\n    return {body}\n"
+    if DEBUG:
+        logger.debug(f"Compiled filter source:\n{source}")
+    exec(compile(source, '<filter>', 'exec'), namespace)
+    return namespace['_filter']
+
+def compile_channel_filter(data):
+    # The compiled predicate lives on the channel entry and is skipped by save_channels
+    data['_filter_fn'] = compile_filter(data['filter']['conditions'], data['filter']['all_must_match'])
+    data.pop('_filter_error', None)
 
 # Parse call template
 def parse_call_template(template_text):
@@ -200,9 +393,13 @@ def parse_call_template(template_text):
     current_type = None
     for line in lines:
         line = line.strip()
-        match = re.match(r'{ЕСЛИ В ПОСТЕ (🔴|🟢|🟥)}', line)
-        if match:
-            current_type = match.group(1)
+        emoji = None
+        if line.startswith(_TEMPLATE_HEADER_PREFIX):
+            # Header is matched as a prefix; anything after the closing brace is ignored
+            rest = line[len(_TEMPLATE_HEADER_PREFIX):]
+            emoji = next((e for e in _TEMPLATE_EMOJIS if rest.startswith(e + '}')), None)
+        if emoji:
+            current_type = emoji
             call_template[current_type] = []
         elif line and current_type:
             call_template[current_type].append(line)
@@ -211,7 +408,8 @@ def parse_call_template(template_text):
 
 # Format call message with dynamic placeholder extraction
 def format_call_message(post_text, call_template):
-    logger.debug(f"Formatting call message for post: {post_text[:100]}...")
+    if DEBUG:
+        logger.debug(f"Formatting call message for post: {post_text[:100]}...")
     if not call_template:
         logger.debug("No call template provided")
         return None
@@ -224,69 +422,67 @@ def format_call_message(post_text, call_template):
             break
 
     if not call_type or not call_template.get(call_type):
-        logger.debug(f"No applicable call template for call type: {call_type}")
+        if DEBUG:
+            logger.debug(f"No applicable call template for call type: {call_type}")
         return None
 
     # Extract all placeholders from the template
     placeholders = set()
     for line in call_template[call_type]:
-        placeholders.update(re.findall(r'\{([^}]+)\}', line))
-
-    # Map placeholders to extraction patterns
-    extraction_patterns = {
-        'Now last price': r'Now last price:\s*\$?(\d+\.?\d*)',
-        'Price': r'Price:\s*\$?(\d+\.?\d+)',
-        'ETA': r'ETA:\s*(\d+m)'
-        # Add more patterns here as needed for new placeholders
-    }
+        placeholders.update(_PLACEHOLDER_RE.findall(line))
+
+    # Extract values for placeholders in a single scan; the first occurrence of each wins
+    wanted = placeholders & _EXTRACTION_PLACEHOLDERS
+    found = {}
+    if wanted:
+        for match in _EXTRACT_ALL_RE.finditer(post_text):
+            found.setdefault(_EXTRACTION_GROUPS[match.lastgroup], match.group(match.lastgroup))
+            if wanted <= found.keys():
+                break
 
-    # Extract values for placeholders
     values = {}
     for placeholder in placeholders:
-        pattern = extraction_patterns.get(placeholder)
-        if pattern:
-            match = re.search(pattern, post_text)
-            values[placeholder] = match.group(1) if match else "N/A"
-        else:
+        if placeholder not in _EXTRACTION_PLACEHOLDERS:
             logger.warning(f"No extraction pattern defined for placeholder {placeholder}")
-            values[placeholder] = "N/A"
-
-    # Format the call message
-    call_lines = call_template[call_type]
-    formatted_message = []
-    for line in call_lines:
-        formatted_line = line
-        for placeholder, value in values.items():
-            formatted_line = formatted_line.replace(f'{{{placeholder}}}', value)
-        formatted_message.append(formatted_line)
-    result = '\n'.join(formatted_message)
-    logger.debug(f"Formatted call message: {result}")
+        values[placeholder] = found.get(placeholder, "N/A")
+
+    # Format the call message; every placeholder matched here was collected into values above
+    fill = lambda match: values[match.group(1)]
+    result = '\n'.join(_PLACEHOLDER_RE.sub(fill, line) for line in call_template[call_type])
+    if DEBUG:
+        logger.debug(f"Formatted call message: {result}")
     return result
 
+# Post scraped from a channel page; slots keep per-post memory small
+@dataclass
+class Post:
+    __slots__ = ('id', 'text', 'url', 'timestamp')
+    id: int
+    text: str
+    url: str
+    timestamp: Optional[datetime]
+
 # HTML parsing with timestamp checking and redirect handling
 async def fetch_posts(channel_name, since_time=None):
     logger.debug(f"Fetching posts from {channel_name}, since_time={since_time}")
     try:
         url = f"https://t.me/s/{channel_name.lstrip('@')}"
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.5',
-            'Connection': 'keep-alive'
-        }
-        response = requests.get(url, headers=headers, timeout=10, allow_redirects=False)
+        async with http_session.get(url, allow_redirects=False) as response:
+            redirect_url = response.headers.get('Location', '') if response.status in (301, 302) else None
+            response.raise_for_status()
+            page_html = await response.text()
 
-        if response.status_code in (301, 302):
-            redirect_url = response.headers.get('Location', '')
+        if redirect_url is not None:
             logger.warning(f"Redirect detected from {url} to {redirect_url}")
             if not redirect_url.startswith('https://t.me/s/'):
                 logger.info(f"Retrying request to {url} to avoid redirect")
-                response = requests.get(url, headers=headers, timeout=10)
+                async with http_session.get(url) as response:
+                    response.raise_for_status()
+                    page_html = await response.text()
 
-        response.raise_for_status()
         logger.debug(f"Successfully fetched URL: {url}")
 
-        soup = BeautifulSoup(response.text, 'html.parser')
+        soup = BeautifulSoup(page_html, 'lxml', parse_only=_STRAINER)
         posts = soup.find_all('div', class_='tgme_widget_message')
         logger.debug(f"Found {len(posts)} posts in {channel_name}")
 
@@ -303,28 +499,32 @@ async def fetch_posts(channel_name, since_time=None):
             if time_elem and time_elem.get('datetime'):
                 post_time = datetime.fromisoformat(time_elem.get('datetime').replace('Z', '+00:00'))
                 if since_time and post_time < since_time:
-                    logger.debug(
-                        f"Skipping post {post_id} from {channel_name}: too old ({post_time} < {since_time})")
+                    if DEBUG:
+                        logger.debug(
+                            f"Skipping post {post_id} from {channel_name}: too old ({post_time} < {since_time})")
                     continue
 
             text_elem = post.find('div', class_='tgme_widget_message_text')
-            raw_text = text_elem.decode_contents() if text_elem else ""
-            raw_text = re.sub(r'<br\s*/>', '\n', raw_text)
-            text = BeautifulSoup(raw_text, 'html.parser').get_text()
-
-            post_data = {
-                'id': post_id,
-                'text': text,
-                'raw_text': raw_text,
-                'url': f"https://t.me/{channel_name.lstrip('@')}/{post_id}",
-                'timestamp': post_time
-            }
-            logger.debug(f"Processed post {post_id} from {channel_name}: {text[:100]}...")
+            text = ""
+            if text_elem:
+                # Turn line breaks into newlines in place, then read the text from the same tree
+                for br in text_elem.find_all('br'):
+                    br.replace_with('\n')
+                text = text_elem.get_text()
+
+            post_data = Post(
+                id=post_id,
+                text=text,
+                url=f"https://t.me/{channel_name.lstrip('@')}/{post_id}",
+                timestamp=post_time
+            )
+            if DEBUG:
+                logger.debug(f"Processed post {post_id} from {channel_name}: {text[:100]}...")
             result.append(post_data)
 
         logger.info(f"Retrieved {len(result)} valid posts from {channel_name}")
         return result
-    except requests.exceptions.RequestException as e:
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
         logger.error(f"Error fetching posts from {channel_name}: {str(e)}")
         return []
     except Exception as e:
@@ -332,8 +532,8 @@ async def fetch_posts(channel_name, since_time=None):
         return []
 
 # Get channel statistics for the last week
-async def get_channel_stats(channel_name, filters):
-    logger.debug(f"Calculating stats for {channel_name} with filters: {filters}")
+async def get_channel_stats(channel_name, channel_filter):
+    logger.debug(f"Calculating stats for {channel_name} with filter: {channel_filter}")
     since_time = datetime.now() - timedelta(days=7)
     posts = await fetch_posts(channel_name, since_time)
     if not posts:
@@ -346,18 +546,17 @@ async def get_channel_stats(channel_name, filters):
         }
 
     total_posts = len(posts)
-    filtered_posts = sum(1 for post in posts if evaluate_filter(post['text'], filters))
+    conditions = channel_filter['conditions']
+    all_must_match = channel_filter['all_must_match']
+    filtered_posts = sum(1 for post in posts if evaluate_filter(post.text, conditions, all_must_match))
     logger.debug(f"Total posts: {total_posts}, Filtered posts: {filtered_posts}")
 
-    word_counts = {}
+    word_counts = Counter()
     for post in posts:
-        words = post['text'].lower().split()
-        for word in words:
-            if len(word) > 3:
-                word_counts[word] = word_counts.get(word, 0) + 1
+        word_counts.update(word for word in post.text.lower().split() if len(word) > 3)
 
-    active_days = len(set(post['timestamp'].date() for post in posts if post['timestamp']))
-    top_words = dict(sorted(word_counts.items(), key=lambda x: x[1], reverse=True)[:5])
+    active_days = len(set(post.timestamp.date() for post in posts if post.timestamp))
+    top_words = dict(word_counts.most_common(5))
     logger.debug(f"Active days: {active_days}, Top words: {top_words}")
 
     result = {
@@ -469,7 +668,8 @@ async def add_channel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(f"Channel {channel} is already added")
         return
 
-    channels[channel] = {'filter': [], 'last_post_id': 0, 'call_template': None}
+    channels[channel] = {'filter': normalize_filter(None), 'last_post_id': 0, 'call_template': None}
+    compile_channel_filter(channels[channel])
     save_channels(channels)
     logger.info(f"Added channel {channel}")
     await update.message.reply_text(f"Channel {channel} added. Set a filter with /set_filter {channel} and a call template with /set_call {channel}")
@@ -557,8 +757,10 @@ async def receive_filter_or_call(update: Update, context: ContextTypes.DEFAULT_T
 
     if filter_channel:
         logger.info(f"Received filter for {filter_channel}: {input_text}")
-        was_empty = not channels[filter_channel]['filter']
+        was_empty = ('_filter_error' not in channels[filter_channel]
+                     and not channels[filter_channel]['filter']['conditions'])
         channels[filter_channel]['filter'] = parse_filter(input_text)
+        compile_channel_filter(channels[filter_channel])
         save_channels(channels)
         logger.info(f"Set filter for {filter_channel}: {input_text}")
         await update.message.reply_text(f"Filter for {filter_channel} set:\n{input_text}")
@@ -606,8 +808,12 @@ async def list_channels(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     response = "List of channels:\n"
     for channel, data in channels.items():
-        filter_text = "No filter" if not data['filter'] else json.dumps(data['filter'], ensure_ascii=False)
-        call_text = "No call template" if not data.get('call_template') else json.dumps(data['call_template'], ensure_ascii=False)
+        if '_filter_error' in data:
+            filter_text = f"Invalid ({data['_filter_error']}): {orjson.dumps(data.get('filter')).decode()}"
+        else:
+            conditions = data['filter']['conditions']
+            filter_text = "No filter" if not conditions else orjson.dumps(conditions).decode()
+        call_text = "No call template" if not data.get('call_template') else orjson.dumps(data['call_template']).decode()
         response += f"{channel}:\nFilter: {filter_text}\nCall Template: {call_text}\n\n"
     logger.debug(f"Channels list response: {response}")
     await update.message.reply_text(response)
@@ -625,6 +831,9 @@ async def weekly_stats(context: ContextTypes.DEFAULT_TYPE):
     stats_text = f"📊 Stats for {week_start.strftime('%d.%m.%Y')}-{week_end.strftime('%d.%m.%Y')}:\n"
 
     for channel, data in channels.items():
+        if '_filter_error' in data:
+            logger.warning(f"Invalid filter for {channel}, skipping stats: {data['_filter_error']}")
+            continue
         stats = await get_channel_stats(channel, data['filter'])
         stats_text += (
             f"\n{channel}:\n"
@@ -638,71 +847,105 @@ async def weekly_stats(context: ContextTypes.DEFAULT_TYPE):
     )
     logger.info("Sent weekly stats")
 
+async def open_http_session(app):
+    global http_session
+    http_session = aiohttp.ClientSession(headers=DEFAULT_HEADERS, timeout=aiohttp.ClientTimeout(total=10))
+    logger.debug("Opened HTTP session")
+
+async def close_http_session(app):
+    if http_session is not None:
+        await http_session.close()
+        logger.debug("Closed HTTP session")
+
 # Main polling loop
+async def process_channel(bot, channel, data):
+    logger.debug(f"Processing channel {channel}")
+    try:
+        posts = await fetch_posts(channel)
+        last_post_id = data.get('last_post_id', 0)
+        logger.debug(f"Last post ID for {channel}: {last_post_id}")
+
+        posts.sort(key=lambda post: post.id)
+        new_posts = [post for post in posts if post.id > last_post_id]
+        if not new_posts:
+            logger.debug(f"No new posts for {channel}")
+            return
+
+        max_post_id = posts[-1].id
+        data['last_post_id'] = max_post_id
+        logger.debug(f"Updated last_post_id for {channel} to {max_post_id}")
+
+        filter_fn = data['_filter_fn']
+        for post in new_posts:
+            logger.info(f"Evaluating post {post.id} from {channel}: {post.text[:100]}...")
+            if filter_fn(post.text):
+                logger.info(f"Post {post.id} from {channel} passed filter")
+                try:
+                    formatted_message = f"From {channel}:\n{post.url}"
+                    call_template = data.get('call_template')
+                    call_message = format_call_message(post.text, call_template) if call_template else None
+                    if call_message:
+                        formatted_message += f"\n\n{call_message}"
+                    await bot.send_message(
+                        chat_id=DEST_CHANNEL_ID,
+                        text=formatted_message,
+                        parse_mode='HTML'
+                    )
+                    logger.info(f"Successfully forwarded post {post.id} from {channel}")
+                except Exception as e:
+                    logger.warning(
+                        f"Failed to send formatted post {post.id} from {channel}: {str(e)}")
+                    await bot.send_message(
+                        chat_id=DEST_CHANNEL_ID,
+                        text=f"From {channel}:\n{post.url}"
+                    )
+                    logger.info(f"Fallback: sent post URL {post.id} from {channel}")
+            else:
+                logger.info(f"Post {post.id} from {channel} did not pass filter")
+
+    except Exception as e:
+        logger.error(f"Error processing channel {channel}: {str(e)}")
+
 async def poll_channels(context: ContextTypes.DEFAULT_TYPE):
     logger.info("Starting poll_channels loop")
     channels = load_channels()
     bot = context.bot
-
-    for channel, data in channels.items():
-        logger.debug(f"Processing channel {channel}")
-        try:
-            if not data['filter']:
-                logger.info(f"No filter set for {channel}, skipping")
-                continue
-
-            posts = await fetch_posts(channel)
-            last_post_id = data.get('last_post_id', 0)
-            logger.debug(f"Last post ID for {channel}: {last_post_id}")
-
-            new_posts = [post for post in posts if post['id'] > last_post_id]
-            if not new_posts:
-                logger.debug(f"No new posts for {channel}")
-                continue
-
-            max_post_id = max(post['id'] for post in posts)
-            channels[channel]['last_post_id'] = max_post_id
-            save_channels(channels)
-            logger.debug(f"Updated last_post_id for {channel} to {max_post_id}")
-
-            for post in sorted(new_posts, key=lambda x: x['id']):
-                logger.info(f"Evaluating post {post['id']} from {channel}: {post['text'][:100]}...")
-                all_must_match = any('"' in json.dumps(cond) for cond in data['filter'])
-                if evaluate_filter(post['text'], data['filter'], all_must_match):
-                    logger.info(f"Post {post['id']} from {channel} passed filter")
-                    try:
-                        formatted_message = f"From {channel}:\n{post['url']}"
-                        call_template = data.get('call_template')
-                        call_message = format_call_message(post['text'], call_template) if call_template else None
-                        if call_message:
-                            formatted_message += f"\n\n{call_message}"
-                        await bot.send_message(
-                            chat_id=DEST_CHANNEL_ID,
-                            text=formatted_message,
-                            parse_mode='HTML'
-                        )
-                        logger.info(f"Successfully forwarded post {post['id']} from {channel}")
-                    except Exception as e:
-                        logger.warning(
-                            f"Failed to send formatted post {post['id']} from {channel}: {str(e)}")
-                        await bot.send_message(
-                            chat_id=DEST_CHANNEL_ID,
-                            text=f"From {channel}:\n{post['url']}"
-                        )
-                        logger.info(f"Fallback: sent post URL {post['id']} from {channel}")
-                else:
-                    logger.info(f"Post {post['id']} from {channel} did not pass filter")
-
-        except Exception as e:
-            logger.error(f"Error processing channel {channel}: {str(e)}")
-
-        await asyncio.sleep(10)
+    semaphore = asyncio.Semaphore(POLL_CONCURRENCY)
+
+    async def process_limited(channel, data):
+        async with semaphore:
+            await process_channel(bot, channel, data)
+
+    # Take a snapshot: the cached dict is shared with command handlers
+    active_channels = []
+    for channel, data in list(channels.items()):
+        if '_filter_error' in data:
+            logger.warning(f"Invalid filter for {channel}, skipping: {data['_filter_error']}")
+            continue
+        if not data['filter']['conditions']:
+            logger.info(f"No filter set for {channel}, skipping")
+            continue
+        active_channels.append((channel, data))
+    last_post_ids = [data.get('last_post_id', 0) for _, data in active_channels]
+
+    # process_channel logs and swallows its own errors, so one failing channel doesn't affect the others
+    await asyncio.gather(*(process_limited(channel, data) for channel, data in active_channels))
+
+    if any(data.get('last_post_id', 0) != last_post_id
+           for (_, data), last_post_id in zip(active_channels, last_post_ids)):
+        save_channels(channels)
     logger.info("Completed poll_channels loop")
 
 def main():
     logger.info(f"BOT_TOKEN: {BOT_TOKEN}, ADMIN_ID: {ADMIN_ID}, DEST_CHANNEL_ID: {DEST_CHANNEL_ID}")
     logger.info("Starting bot")
-    app = Application.builder().token(BOT_TOKEN).build()
+    app = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .post_init(open_http_session)
+        .post_shutdown(close_http_session)
+        .build()
+    )
 
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("add", add_channel))